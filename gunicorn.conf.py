@@ -0,0 +1,7 @@
+# Gunicorn picks this file up automatically when started from the repo root (gunicorn app:app)
+
+# /status long-polls for up to STATUS_LONG_POLL_SECONDS, so serve requests from threads:
+# an open results page then holds one thread instead of a whole sync worker, and the
+# rest of the site keeps responding. The worker count still comes from WEB_CONCURRENCY.
+worker_class = 'gthread'
+threads = 16
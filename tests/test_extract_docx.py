@@ -0,0 +1,54 @@
+import io
+import os
+import unittest
+import zipfile
+
+# app.py refuses to import without it; the client connects lazily, so nothing is contacted
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/0')
+
+from app import extract_text_from_docx
+
+# A paragraph holding a text box the way Word saves it: a DrawingML copy in
+# mc:Choice and a VML copy of the same text in mc:Fallback
+DOCUMENT_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+            xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"
+            xmlns:wps="http://schemas.microsoft.com/office/word/2010/wordprocessingShape"
+            xmlns:v="urn:schemas-microsoft-com:vml">
+  <w:body>
+    <w:p><w:r><w:t>Jane Doe</w:t></w:r></w:p>
+    <w:p>
+      <w:r>
+        <mc:AlternateContent>
+          <mc:Choice Requires="wps">
+            <wps:txbx><w:txbxContent><w:p><w:r><w:t>jane@example.com</w:t></w:r></w:p></w:txbxContent></wps:txbx>
+          </mc:Choice>
+          <mc:Fallback>
+            <v:textbox><w:txbxContent><w:p><w:r><w:t>jane@example.com</w:t></w:r></w:p></w:txbxContent></v:textbox>
+          </mc:Fallback>
+        </mc:AlternateContent>
+      </w:r>
+    </w:p>
+    <w:p><w:r><w:t>Python</w:t><w:tab/><w:t>SQL</w:t></w:r></w:p>
+  </w:body>
+</w:document>
+"""
+
+def make_docx(document_xml):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as z:
+        z.writestr('word/document.xml', document_xml)
+    return buf.getvalue()
+
+class ExtractTextFromDocxTest(unittest.TestCase):
+    def test_text_box_text_appears_once(self):
+        text = extract_text_from_docx(make_docx(DOCUMENT_XML))
+        self.assertEqual(text.count("jane@example.com"), 1)
+
+    def test_keeps_paragraphs_and_tabs(self):
+        text = extract_text_from_docx(make_docx(DOCUMENT_XML))
+        self.assertIn("Jane Doe", text)
+        self.assertIn("Python\tSQL", text)
+
+if __name__ == '__main__':
+    unittest.main()
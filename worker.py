@@ -2,20 +2,34 @@ import uuid
 import os
 import io
 import re
-import json
 import time
+import math
+import random
+import hashlib
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 from flask import Flask, request, render_template, jsonify, send_from_directory, redirect, url_for, send_file
 from werkzeug.utils import secure_filename
-import pdfplumber
-from docx import Document
+import pymupdf
+from lxml import etree
 from openpyxl import Workbook
 from openpyxl.styles import Font
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
 import requests
+import orjson
+from requests.adapters import HTTPAdapter
 from redis import Redis
 import rq # Redis Queue
+from rq.registry import FailedJobRegistry
 
 # --- Setup ---
 app = Flask(__name__)
+STATUS_LONG_POLL_SECONDS = 10 # How long /status waits for a job to finish (holds one gunicorn thread, see gunicorn.conf.py)
+MAX_FILE_BYTES = 20_000_000 # Per-file limit, kept under the Redis free tier limit (25MB)
+# Let Werkzeug reject absurd request bodies before they reach our code
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_BYTES * 20
 
 # --- NEW: Setup Redis & RQ (The "To-Do List") ---
 # Render will provide this URL as an environment variable
@@ -23,13 +37,40 @@ REDIS_URL = os.environ.get('REDIS_URL')
 if not REDIS_URL:
     raise RuntimeError("REDIS_URL environment variable not set.")
 
-app.redis = Redis.from_url(REDIS_URL)
+# Keepalive + health checks let long-lived worker connections survive idle periods
+app.redis = Redis.from_url(REDIS_URL, socket_keepalive=True, health_check_interval=30)
 app.queue = rq.Queue('resume-processing', connection=app.redis)
+app.failed_jobs = FailedJobRegistry(queue=app.queue) # RQ's sorted set of failed job IDs
 
 # --- AI & Text Extraction (No changes here) ---
 API_KEY = os.environ.get('GOOGLE_API_KEY', '')
 GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-09-2025:generateContent?key={API_KEY}"
+AI_MAX_WORKERS = 8 # Concurrent Gemini calls per job
+PDF_LOCK = threading.Lock() # PyMuPDF is not thread-safe, so job threads take turns parsing PDFs
+
+# One shared session so every Gemini call reuses pooled keep-alive/TLS connections
+# (one host, and at most AI_MAX_WORKERS requests in flight at a time)
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=AI_MAX_WORKERS))
+SESSION.headers.update({'Content-Type': 'application/json'})
+
 ILLEGAL_CHAR_RE = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F\uE000-\uF8FF]')
+# The ASCII subset of ILLEGAL_CHAR_RE, as a str.translate deletion table
+ILLEGAL_ASCII_TABLE = dict.fromkeys([*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20), 0x7F])
+HSPACE_RE = re.compile(r'[^\S\n]+') # Runs of spaces/tabs, but not line breaks
+NEWLINES_RE = re.compile(r' ?\n\s*') # A line break plus any blank lines/indent after it
+MAX_PROMPT_CHARS = 12000 # Resume text sent to Gemini is capped at this many characters
+PROMPT_HEAD_CHARS = 8000 # ...made of this much from the start, the rest from the end
+# Parsed resume fields (name, email, phone...) stay in Redis this long, independent of
+# the job and its one-time download. This is a deliberate trade-off: re-uploads of the
+# same resume within the window skip Gemini. Lower it to shorten PII retention.
+AI_CACHE_TTL_SECONDS = 3600
+# WordprocessingML tags we read text from (paragraph, text run, tab, line break)
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+W_P, W_T, W_TAB, W_BR = W_NS + 'p', W_NS + 't', W_NS + 'tab', W_NS + 'br'
+# Text boxes are stored twice: DrawingML in mc:Choice and a VML copy in mc:Fallback
+MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+DOCX_XML_PARSER = etree.XMLParser(resolve_entities=False)
 RESUME_SCHEMA = {
     "type": "OBJECT",
     "properties": {
@@ -68,72 +109,143 @@ RESUME_SCHEMA = {
     }
 }
 
+# The request body is the same for every resume except the prompt text, so it is
+# encoded once here and split around a placeholder; each call only encodes the prompt
+GEMINI_BODY_HEAD, GEMINI_BODY_TAIL = orjson.dumps({
+    "contents": [{ "parts": [{ "text": "__PROMPT__" }] }],
+    "generationConfig": { "responseMimeType": "application/json", "responseSchema": RESUME_SCHEMA }
+}).split(b'"__PROMPT__"')
+
 # --- This function will be run by the WORKER, not the web app ---
 # We define it here so the 'app' module context is shared.
 
 def clean_text(text):
     if not isinstance(text, str): return ""
+    # translate runs in C and is ~10x faster than the regex on pure-ASCII text,
+    # but its per-character dict lookups make it slower once non-ASCII shows up
+    if text.isascii(): return text.translate(ILLEGAL_ASCII_TABLE)
     return ILLEGAL_CHAR_RE.sub('', text)
 
-def extract_text_from_pdf(pdf_stream):
+def extract_text_from_pdf(pdf_bytes):
     text = ""
     try:
-        with pdfplumber.open(pdf_stream) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
+        with PDF_LOCK, pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+            # Scanned/image-only pages reference no fonts, so skip them without running the text extractor
+            text = "\n".join(page.get_text("text") for page in doc if page.get_fonts())
     except Exception as e:
         print(f"Error reading PDF: {e}")
         return ""
     return clean_text(text)
 
-def extract_text_from_docx(docx_stream):
+def extract_text_from_docx(docx_bytes):
     text = ""
     try:
-        doc = Document(docx_stream)
-        for para in doc.paragraphs:
-            text += para.text + "\n"
+        # A .docx is a zip; all the body text lives in word/document.xml
+        with zipfile.ZipFile(io.BytesIO(docx_bytes)) as z:
+            root = etree.parse(z.open('word/document.xml'), DOCX_XML_PARSER).getroot()
+        # Drop the fallback copies so text-box content is only read once
+        for fallback in list(root.iter(MC_FALLBACK)):
+            fallback.getparent().remove(fallback)
+        parts = []
+        for el in root.iter(W_P, W_T, W_TAB, W_BR):
+            if el.tag == W_T:
+                parts.append(el.text or "")
+            elif el.tag == W_P:
+                if parts: parts.append("\n")
+            else:
+                parts.append("\t" if el.tag == W_TAB else "\n")
+        text = "".join(parts)
     except Exception as e:
         print(f"Error reading DOCX: {e}")
         return ""
     return clean_text(text)
 
+# File extension -> text extractor, for every upload type we accept
+EXTRACTORS = {'.pdf': extract_text_from_pdf, '.docx': extract_text_from_docx}
+
+def get_extractor(filename):
+    return EXTRACTORS.get(os.path.splitext(filename)[1].lower())
+
+def shorten_resume_text(text):
+    # Fewer input tokens means a faster (and cheaper) Gemini call
+    # Squeeze whitespace but keep line breaks (one blank line at most), since the
+    # line layout helps the model tell sections and fields apart
+    text = HSPACE_RE.sub(' ', text)
+    text = NEWLINES_RE.sub(lambda m: '\n\n' if m.group().count('\n') > 1 else '\n', text).strip()
+    if len(text) > MAX_PROMPT_CHARS:
+        # Keep the tail too, contact details are often at the very end
+        text = text[:PROMPT_HEAD_CHARS] + " ... " + text[-(MAX_PROMPT_CHARS - PROMPT_HEAD_CHARS):]
+    return text
+
 def get_structured_data_from_ai(resume_text):
     if not resume_text or not API_KEY:
         print("Skipping AI call: No text or no API key.")
         return {"name": "Error: No text or API key", "email": "", "phone": "", "summary": ""}
     
-    payload = {
-        "contents": [{ "parts": [{ "text": f"Extract the relevant information from this resume text:\n\n{resume_text}" }] }],
-        "generationConfig": { "responseMimeType": "application/json", "responseSchema": RESUME_SCHEMA }
-    }
+    prompt = f"Extract the relevant information from this resume text:\n\n{shorten_resume_text(resume_text)}"
+    body = GEMINI_BODY_HEAD + orjson.dumps(prompt) + GEMINI_BODY_TAIL # Built once, reused by every retry
     
     retries = 3
     for i in range(retries):
+        # Exponential backoff with jitter so concurrent calls don't retry in lockstep
+        delay = 2 ** i + random.uniform(0, 0.5)
         try:
-            response = requests.post(GEMINI_API_URL, json=payload, headers={'Content-Type': 'application/json'}, timeout=60)
+            response = SESSION.post(GEMINI_API_URL, data=body, timeout=60)
             if response.status_code == 200:
-                json_text = response.json().get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '{}')
-                return json.loads(json_text)
+                json_text = orjson.loads(response.content).get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '{}')
+                return orjson.loads(json_text)
+            elif response.status_code == 429 or response.status_code >= 500:
+                # Rate limited or server-side error: worth retrying, honoring Retry-After if given
+                try:
+                    retry_after = float(response.headers['Retry-After'])
+                except (KeyError, ValueError):
+                    retry_after = None
+                # Ignore junk like "nan"/"inf" and keep negative values from reaching time.sleep
+                if retry_after is not None and math.isfinite(retry_after):
+                    delay = max(0.0, min(retry_after, 60)) + random.uniform(0, 0.5)
+                print(f"Error calling Gemini API: {response.status_code} {response.text}. Retrying in {delay:.1f}s...")
             else:
-                print(f"Error calling Gemini API: {response.status_code} {response.text}. Retrying in {i+1}s...")
-                time.sleep(i + 1)
+                # Other 4xx errors (bad key, bad request) won't succeed on retry
+                print(f"Error calling Gemini API: {response.status_code} {response.text}. Not retrying.")
+                break
         except Exception as e:
             print(f"Error in get_structured_data_from_ai: {e}")
-            time.sleep(i + 1)
+
+        if i < retries - 1:
+            time.sleep(delay)
 
     print("Gemini API call failed after all retries.")
     return {"name": "Error: AI API call failed", "email": "", "phone": "", "summary": ""}
 
+def resume_digest(resume_text):
+    # Identifies a resume by its extracted text, so the same CV uploaded as PDF and DOCX matches
+    return hashlib.blake2b(resume_text.encode(), digest_size=16).hexdigest()
+
+def get_structured_data_cached(resume_text, redis_conn, digest=None):
+    """
+    Same as get_structured_data_from_ai, but reuses the result for identical
+    resume text seen in the last AI_CACHE_TTL_SECONDS instead of calling Gemini again.
+    The cached entry outlives the job that created it (see AI_CACHE_TTL_SECONDS).
+    """
+    cache_key = f"ai:cache:{digest or resume_digest(resume_text)}"
+    cached = redis_conn.get(cache_key)
+    if cached:
+        return orjson.loads(cached)
+
+    ai_data = get_structured_data_from_ai(resume_text)
+    # Only cache real results, not the error placeholders
+    if not str(ai_data.get('name', '')).startswith("Error:"):
+        redis_conn.set(cache_key, orjson.dumps(ai_data), ex=AI_CACHE_TTL_SECONDS)
+    return ai_data
+
 def generate_excel_in_memory(all_resume_data):
-    wb = Workbook()
-    ws = wb.active
+    # write_only streams rows straight to the file instead of keeping a Cell object per value
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
     headers = ["Filename", "Name", "Email", "Phone", "Summary", "Skills", "Recent Experience", "Education"]
-    ws.append(headers)
-    
-    for cell in ws["1:1"]: cell.font = Font(bold=True)
+    max_len = [len(h) for h in headers]
 
+    rows = []
     for data in all_resume_data:
         if not data: continue
         skills = ", ".join(data.get('skills', []))
@@ -149,20 +261,29 @@ def generate_excel_in_memory(all_resume_data):
             first_edu = edu_list[0]
             edu_str = f"{first_edu.get('degree', 'N/A')}, {first_edu.get('institution', 'N/A')}"
 
-        ws.append([
+        row = [
             data.get('filename', 'N/A'), data.get('name', 'N/A'), data.get('email', 'N/A'),
             data.get('phone', 'N/A'), data.get('summary', 'N/A'), skills, exp_str, edu_str
-        ])
-
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length: max_length = len(str(cell.value))
-            except: pass
-        adjusted_width = (max_length + 2)
-        ws.column_dimensions[column].width = min(adjusted_width, 60)
+        ]
+        # Each value is stringified once; width follows its longest line
+        for i, value in enumerate(row):
+            longest = max(map(len, str(value).split('\n'))) if value else 0
+            if longest > max_len[i]: max_len[i] = longest
+        rows.append(row)
+
+    # In write_only mode column widths must be set before the first row is written
+    for i, length in enumerate(max_len):
+        ws.column_dimensions[get_column_letter(i + 1)].width = min(length + 2, 60)
+
+    header_row = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True)
+        header_row.append(cell)
+    ws.append(header_row)
+
+    for row in rows:
+        ws.append(row)
     
     # Save to a memory buffer
     memory_file = io.BytesIO()
@@ -171,6 +292,39 @@ def generate_excel_in_memory(all_resume_data):
     return memory_file
 
 # --- NEW: This is the long-running job for the worker ---
+def _process_one(filename, file_bytes, redis_conn, in_flight, in_flight_lock):
+    """
+    Extracts the text of one resume and gets its structured data from Gemini.
+    Runs on the job's thread pool; returns None if the file had no text.
+    Files of the same job with identical text share one lookup through in_flight
+    ({ text digest: Future }), even before the first one has reached the cache.
+    """
+    try:
+        extractor = get_extractor(filename)
+        text = extractor(file_bytes) if extractor else "" # Parsed straight from the Redis bytes
+        if not text:
+            return None
+
+        digest = resume_digest(text)
+        with in_flight_lock:
+            shared = in_flight.get(digest)
+            is_owner = shared is None
+            if is_owner:
+                shared = in_flight[digest] = Future()
+        if not is_owner:
+            return shared.result() # Another thread already has this text in progress
+
+        try:
+            ai_data = get_structured_data_cached(text, redis_conn, digest)
+        except Exception as e:
+            shared.set_exception(e)
+            raise
+        shared.set_result(ai_data)
+        return ai_data
+    except Exception as e:
+        print(f"CRITICAL: Failed to process {filename}. Error: {e}")
+        return {"name": f"Error processing {filename}", "email": "", "phone": "", "summary": str(e)}
+
 def process_resumes_job(job_id, file_keys):
     """
     This function is run by the BACKGROUND WORKER.
@@ -179,41 +333,42 @@ def process_resumes_job(job_id, file_keys):
     print(f"Worker starting job {job_id} with {len(file_keys)} files.")
     all_resume_data = []
     
-    # Must connect to Redis *inside the worker*
-    redis_conn = Redis.from_url(os.environ.get('REDIS_URL'))
+    # app.redis is created when the worker imports this module, so jobs skip parsing the
+    # URL and building a client. RQ's Worker forks a work horse per job and redis-py resets
+    # the pool after a fork, so each job still opens its own connection.
+    redis_conn = app.redis
     
     file_keys_to_delete = []
     
     try:
-        for key, filename in file_keys.items():
-            print(f"Processing file: {filename} (key: {key})")
-            file_bytes = redis_conn.get(key)
-            
-            if not file_bytes:
-                print(f"Error: File bytes not found in Redis for key {key}")
-                continue
+        # Each file is handed to the pool as soon as it is fetched, so parsing one file
+        # overlaps with the Gemini calls (the slow, I/O-bound part) of the others
+        with ThreadPoolExecutor(max_workers=min(AI_MAX_WORKERS, len(file_keys))) as ex:
+            futures = [] # To store (filename, future), in upload order
+            in_flight, in_flight_lock = {}, threading.Lock() # Text dedup, see _process_one
+            # One MGET round-trip for all uploads instead of a GET per file
+            keys = list(file_keys)
+            blobs = redis_conn.mget(keys)
+            for i, key in enumerate(keys):
+                file_bytes, blobs[i] = blobs[i], None # Only the pool holds each upload, until its task finishes
+                filename = file_keys[key]
+                print(f"Processing file: {filename} (key: {key})")
                 
-            file_stream = io.BytesIO(file_bytes)
-            text = ""
-            
-            try:
-                if filename.endswith('.pdf'):
-                    text = extract_text_from_pdf(file_stream)
-                elif filename.endswith('.docx'):
-                    text = extract_text_from_docx(file_stream)
+                if not file_bytes:
+                    print(f"Error: File bytes not found in Redis for key {key}")
+                    continue
                 
-                if text:
-                    ai_data = get_structured_data_from_ai(text)
+                file_keys_to_delete.append(key)
+                futures.append((filename, ex.submit(_process_one, filename, file_bytes, redis_conn, in_flight, in_flight_lock)))
+                del file_bytes
+
+            # Collect in upload order so the Excel rows stay stable
+            for filename, future in futures:
+                ai_data = future.result()
+                if ai_data:
+                    ai_data = dict(ai_data) # Copy, duplicates share the result
                     ai_data['filename'] = filename
                     all_resume_data.append(ai_data)
-            
-            except Exception as e:
-                print(f"CRITICAL: Failed to process {filename}. Error: {e}")
-                all_resume_data.append({"name": f"Error processing {filename}", "email": "", "phone": "", "summary": str(e)})
-            
-            finally:
-                # Add key to delete list even if it failed
-                file_keys_to_delete.append(key)
 
         if not all_resume_data:
             print(f"Job {job_id} resulted in no data.")
@@ -222,11 +377,10 @@ def process_resumes_job(job_id, file_keys):
 
         # Save the final Excel file *in memory*
         excel_memory_file = generate_excel_in_memory(all_resume_data)
-        excel_bytes = excel_memory_file.getvalue()
         
-        # Save the final Excel bytes *to Redis*
+        # Save the final Excel bytes *to Redis* (getbuffer() hands over the buffer without copying it)
         result_key = f"job:{job_id}:result"
-        redis_conn.set(result_key, excel_bytes, ex=3600) # Keep result for 1 hour
+        redis_conn.set(result_key, excel_memory_file.getbuffer(), ex=3600) # Keep result for 1 hour
         
         print(f"Worker finished job {job_id}. Result stored in Redis key {result_key}")
 
@@ -235,6 +389,9 @@ def process_resumes_job(job_id, file_keys):
         redis_conn.set(f"job:{job_id}:result", f"error: {e}", ex=3600)
     
     finally:
+        # Wake up every /status request long-polling for this job (a result is always set by now)
+        redis_conn.publish(f"job:{job_id}:done", 1)
+        
         # Clean up the uploaded files from Redis
         if file_keys_to_delete:
             redis_conn.delete(*file_keys_to_delete)
@@ -259,19 +416,23 @@ def upload_file():
         try:
             with app.redis.pipeline() as pipe:
                 for file in files:
-                    if file and (file.filename.endswith('.pdf') or file.filename.endswith('.docx')):
+                    if file and get_extractor(file.filename):
                         filename = secure_filename(file.filename)
-                        file_bytes = file.read()
-                        
-                        # Check against Redis free tier limit (25MB)
-                        if len(file_bytes) > 20_000_000: # 20MB limit for safety
-                             return jsonify({"error": f"File '{filename}' is too large. Max 20MB."}), 413
+                        # Trust a declared size if there is one, otherwise read at most one byte
+                        # past the limit, so an oversized file is never loaded whole
+                        too_large = file.content_length > MAX_FILE_BYTES
+                        if not too_large:
+                            file_bytes = file.stream.read(MAX_FILE_BYTES + 1)
+                            too_large = len(file_bytes) > MAX_FILE_BYTES
+                        if too_large:
+                             return jsonify({"error": f"File '{filename}' is too large. Max {MAX_FILE_BYTES // 1_000_000}MB."}), 413
                         
                         redis_key = f"job:{job_id}:file:{uuid.uuid4()}"
                         pipe.set(redis_key, file_bytes, ex=3600) # Expire in 1 hour
                         file_keys[redis_key] = filename
-            
-            pipe.execute() # Execute all file saves at once
+                
+                # Must run inside the 'with': leaving it resets the pipeline and drops the queued SETs
+                pipe.execute() # Execute all file saves at once (one round-trip)
         
         except Exception as e:
             print(f"Error saving to Redis: {e}")
@@ -281,13 +442,20 @@ def upload_file():
             return jsonify({"error": "No valid .pdf or .docx files found."}), 400
 
         # Add the job to the Redis "To-Do List"
-        app.queue.enqueue('app.process_resumes_job', job_id, file_keys, job_timeout=1800) # 30 min timeout
+        # RQ job ID = our job ID, so /status can look the job up in RQ's registries
+        app.queue.enqueue('app.process_resumes_job', job_id, file_keys, job_id=job_id, job_timeout=1800) # 30 min timeout
 
         # Respond *immediately* with the job ID
         return jsonify({"success": True, "job_id": job_id})
             
     return render_template('index.html')
 
+@app.errorhandler(413)
+def request_too_large(e):
+    # Raised by Werkzeug when the whole upload exceeds MAX_CONTENT_LENGTH
+    max_mb = app.config['MAX_CONTENT_LENGTH'] // 1_000_000
+    return jsonify({"error": f"Upload is too large. Max {max_mb}MB in total."}), 413
+
 @app.route('/results')
 def results_page():
     """Renders the results page. JS will poll for status."""
@@ -301,6 +469,24 @@ def job_status(job_id):
     result_key = f"job:{job_id}:result"
     result = app.redis.get(result_key)
     
+    if not result:
+        # Long-poll: wait for the worker's "done" message instead of making the browser come
+        # back every second. Pub/sub is a broadcast, so every open tab is woken, not just one.
+        # PubSub.reset() disconnects its connection on exit, so each long-poll opens a fresh
+        # Redis connection (about one per open results page every ~11s). That churn is accepted
+        # in exchange for not running a shared subscriber thread in every web worker.
+        with app.redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+            pubsub.subscribe(f"job:{job_id}:done")
+            result = app.redis.get(result_key) # The job may have finished before we subscribed
+            deadline = time.monotonic() + STATUS_LONG_POLL_SECONDS
+            while not result:
+                # Read the clock once, a negative timeout makes the socket raise ValueError
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if pubsub.get_message(timeout=remaining):
+                    result = app.redis.get(result_key)
+    
     if result:
         # Check if the result was an error message
         if result.startswith(b"error:"):
@@ -309,14 +495,9 @@ def job_status(job_id):
         # Success!
         return jsonify({"status": "complete", "download_url": url_for('download_file', job_id=job_id)})
     else:
-        # Job not done, check if it failed in the RQ queue
-        try:
-            job = rq.Job.fetch(job_id, connection=app.redis)
-            status = job.get_status()
-            if status == 'failed':
-                return jsonify({"status": "failed", "error": "Job failed during processing."})
-        except:
-             pass # Job not found, means it's pending or finished
+        # Job not done, check if it failed in the RQ queue (one ZSCORE, no job unpickling)
+        if job_id in app.failed_jobs:
+            return jsonify({"status": "failed", "error": "Job failed during processing."})
         
         return jsonify({"status": "pending"})
 